@@ -1,32 +1,92 @@
 import json
+import re
+import threading
 from base64 import b64encode
-from datetime import datetime, UTC
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
 from os import urandom
 
 import requests
 from cryptography.hazmat.primitives.ciphers import Cipher
 from cryptography.hazmat.primitives.ciphers.algorithms import AES
 from cryptography.hazmat.primitives.ciphers.modes import ECB
-from cryptography.hazmat.primitives.padding import PKCS7
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
-from flask import current_app, render_template_string
-from markupsafe import Markup
-from sqlalchemy import Boolean, Column, DateTime, Text
-from sqlalchemy.dialects.postgresql import JSON
-from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import deferred
+from flask import current_app, request
+from markupsafe import Markup, escape
+from requests.adapters import HTTPAdapter
+
+try:
+    from pybase64 import b64encode_as_string
+except ImportError:
+    def b64encode_as_string(data):
+        return b64encode(data).decode()
+
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+    json_loads = json.loads
+
+# Pre-bound FFI symbols for the per-request OpenSSL calls, saving the
+# backend._lib attribute chain on every invocation. Every symbol the
+# fast paths touch is probed before anything is bound, so a stripped
+# binding (modern cryptography removed most of them) leaves
+# openssl_backend as None rather than a half-initialized module.
+try:
+    from cryptography.hazmat.backends.openssl.backend import (
+        backend as openssl_backend)
+    for _name in (
+            'EVP_aes_128_ecb', 'EVP_CIPHER_CTX_new', 'EVP_CIPHER_CTX_free',
+            'EVP_CIPHER_CTX_set_padding', 'EVP_EncryptInit_ex',
+            'EVP_EncryptUpdate', 'EVP_EncryptFinal_ex', 'EVP_PKEY_CTX_new',
+            'EVP_PKEY_CTX_free', 'EVP_PKEY_sign_init', 'EVP_PKEY_sign',
+            'EVP_PKEY_CTX_set_rsa_padding', 'RSA_PKCS1_PADDING',
+            'EVP_PKEY_size'):
+        getattr(openssl_backend._lib, _name)
+except (ImportError, AttributeError):
+    openssl_backend = None
+else:
+    _NULL = openssl_backend._ffi.NULL
+    _ffi_new = openssl_backend._ffi.new
+    _EVP_aes_128_ecb = openssl_backend._lib.EVP_aes_128_ecb
+    _EVP_CIPHER_CTX_set_padding = \
+        openssl_backend._lib.EVP_CIPHER_CTX_set_padding
+    _EVP_EncryptInit_ex = openssl_backend._lib.EVP_EncryptInit_ex
+    _EVP_EncryptUpdate = openssl_backend._lib.EVP_EncryptUpdate
+    _EVP_EncryptFinal_ex = openssl_backend._lib.EVP_EncryptFinal_ex
+    _EVP_PKEY_sign = openssl_backend._lib.EVP_PKEY_sign
+
+API_URL = 'https://api.fastspring.com'
 
 
 class FastSpring:
 
+    __slots__ = (
+        'debug', 'storefront', 'username', 'password', 'openssl',
+        'session', 'access_key', 'private_key',
+        'head_template', 'head_template_plain',
+        '_aes_local', '_rsa_ctx', '_rsa_local', '_rsa_out_len',
+        '_head_cache')
+
     def __init__(self, app=None):
         self.debug = None
         self.storefront = None
         self.username = None
         self.password = None
         self.openssl = None
+        self.session = requests.Session()
+        self.session.mount(
+            'https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
         self.access_key = None
         self.private_key = None
+        self.head_template = None
+        self.head_template_plain = None
+        self._head_cache = None
+        self._aes_local = threading.local()
+        self._rsa_ctx = None
+        self._rsa_local = threading.local()
+        self._rsa_out_len = None
         if app is not None:
             self.init_app(app)
 
@@ -51,15 +111,38 @@ class FastSpring:
         self.username = app.config['FASTSPRING_USERNAME']
         self.password = app.config['FASTSPRING_PASSWORD']
         self.access_key = app.config.get('FASTSPRING_ACCESS_KEY')
+        self.session.auth = (self.username, self.password)
+        self.head_template = app.jinja_env.from_string(HEAD_TEMPLATE)
+        self.head_template_plain = app.jinja_env.from_string(
+            HEAD_TEMPLATE_PLAIN)
+        self._head_cache = {}
         if self.debug:
             return
         private_key = app.config.get('FASTSPRING_PRIVATE_KEY')
         if private_key is not None:
-            from cryptography.hazmat.backends.openssl.backend import backend
-            self.openssl = backend
             with open(private_key, 'rb') as fp:
+                pem = fp.read()
+            # The key only encrypts random per-request AES keys, never
+            # attacker-controlled data, so the consistency check that
+            # dominates key import is skipped where supported.
+            try:
+                self.private_key = load_pem_private_key(
+                    pem, password=None,
+                    unsafe_skip_rsa_key_validation=True)
+            except TypeError:
+                # cryptography releases before the keyword existed
                 self.private_key = load_pem_private_key(
-                    fp.read(), password=None, backend=self.openssl)
+                    pem, password=None, backend=openssl_backend)
+            if openssl_backend is None or not hasattr(
+                    self.private_key, '_evp_pkey'):
+                # No usable bindings or a Rust-backed key object;
+                # secure_key falls back to the pure-Python path.
+                return
+            self.openssl = openssl_backend
+            self._rsa_ctx = openssl_sign_context(
+                self.private_key, self.openssl)
+            self._rsa_out_len = openssl_backend._lib.EVP_PKEY_size(
+                self.private_key._evp_pkey)
 
     def secure(self, payload):
         """Return payload secured with random key.
@@ -75,7 +158,11 @@ class FastSpring:
                     ...
                 }),
             })
+
+        In debug mode the payload is passed through unencrypted.
         """
+        if self.debug:
+            return {'payload': payload, 'key': ''}
         key = self.random_key()
         return {
             'payload': self.secure_payload(key, payload),
@@ -84,49 +171,98 @@ class FastSpring:
 
     def random_key(self):
         """Return random AES key."""
-        if self.debug:
-            return ''
         return urandom(16)
 
     def secure_payload(self, key, payload):
         """Return payload secured with AES key."""
-        if self.debug:
-            return payload
-        padder = PKCS7(128).padder()
-        encryptor = Cipher(AES(key), ECB(), backend=self.openssl).encryptor()
-        result = []
-        data = json.dumps(payload).encode()
-        result.append(encryptor.update(padder.update(data)))
-        result.append(encryptor.update(padder.finalize()))
-        result.append(encryptor.finalize())
-        return b64encode(b''.join(result)).decode()
+        data = json_dumps(payload)
+        pad = 16 - (len(data) & 15)
+        data += bytes((pad,)) * pad
+        if openssl_backend is None:
+            encryptor = Cipher(AES(key), ECB()).encryptor()
+            result = encryptor.update(data) + encryptor.finalize()
+        else:
+            result = openssl_aes_encrypt(
+                key, data, self._aes_local, openssl_backend)
+        return b64encode_as_string(result)
 
     def secure_key(self, key):
         """Return AES key secured with RSA private key."""
-        if self.debug:
-            return key
-        result = openssl_private_encrypt(self.private_key, key, self.openssl)
-        return b64encode(result).decode()
+        if self._rsa_ctx is None:
+            return b64encode_as_string(
+                rsa_private_encrypt(self.private_key, key))
+        local = self._rsa_local
+        buffer = getattr(local, 'buffer', None)
+        if buffer is None or len(buffer) != self._rsa_out_len:
+            # Also replaces buffers sized for a previous key when
+            # init_app runs again with a different key.
+            buffer = local.buffer = _ffi_new(
+                'unsigned char[]', self._rsa_out_len)
+            local.outlen = _ffi_new('size_t *')
+        result = openssl_private_encrypt(
+            self._rsa_ctx, key, buffer, local.outlen, self.openssl)
+        return b64encode_as_string(result)
 
     def render_head(self, webhook=None, session=None, payload=None):
-        html = render_template_string(
-            HEAD_TEMPLATE,
+        if webhook is None:
+            # Without a webhook the markup depends only on the session
+            # (payload and request appear inside the webhook block), so
+            # the rendered result can be cached. The serialized session
+            # is only the cache key; the template always renders from
+            # the original object, so cached and uncached paths produce
+            # identical markup. Sessions the serializer cannot handle
+            # are rendered uncached.
+            try:
+                key = json_dumps(session)
+            except TypeError:
+                key = None
+            if key is not None:
+                cached = self._head_cache.get(key)
+                if cached is not None:
+                    return cached
+            html = self.head_template_plain.render(
+                storefront=self.storefront,
+                access_key=self.access_key,
+                session=session)
+            result = Markup(html)
+            if key is not None:
+                if len(self._head_cache) >= 64:
+                    self._head_cache.clear()
+                self._head_cache[key] = result
+            return result
+        html = self.head_template.render(
             storefront=self.storefront,
             access_key=self.access_key,
             webhook=webhook,
             session=session,
-            payload=payload)
+            payload=payload,
+            request=request)
         return Markup(html)
 
+    _BUTTON_PREFIX = Markup(
+        'data-fsc-action="Add,Checkout" data-fsc-item-path-value="')
+    _BUTTON_SUFFIX = Markup('"')
+
     def render_button(self, product):
-        t = 'data-fsc-action="Add,Checkout" data-fsc-item-path-value="{}"'
-        return Markup(t.format(product))
+        return self._BUTTON_PREFIX + escape(product) + self._BUTTON_SUFFIX
 
     def fetch_order(self, order_id):
-        return self.fetch('/orders/{}'.format(order_id))
+        return self.fetch(f'/orders/{order_id}')
+
+    def fetch_orders(self, order_ids):
+        """Fetch many orders concurrently, as a dict by order id."""
+        order_ids = list(order_ids)
+        uris = [f'/orders/{i}' for i in order_ids]
+        return dict(zip(order_ids, self.fetch_many(uris)))
 
     def fetch_subscription(self, subscription_id):
-        return self.fetch('/subscriptions/{}'.format(subscription_id))
+        return self.fetch(f'/subscriptions/{subscription_id}')
+
+    def fetch_subscriptions(self, subscription_ids):
+        """Fetch many subscriptions concurrently, as a dict by id."""
+        subscription_ids = list(subscription_ids)
+        uris = [f'/subscriptions/{i}' for i in subscription_ids]
+        return dict(zip(subscription_ids, self.fetch_many(uris)))
 
     def cancel_subscription(self, subscription_id, immediately=True):
         params = {}
@@ -134,117 +270,345 @@ class FastSpring:
             params['billingPeriod'] = '0'
         return self.request(
             'DELETE',
-            '/subscriptions/{}'.format(subscription_id),
+            f'/subscriptions/{subscription_id}',
             params=params)
 
     def fetch(self, uri):
         return self.request('GET', uri)
 
+    def fetch_many(self, uris):
+        """Fetch many URIs concurrently, preserving order."""
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            return list(executor.map(self.fetch, uris))
+
+    def fetch_lazy(self, uri, path='items.item'):
+        """Stream objects under the given ijson path from a GET.
+
+        Yields the matching objects incrementally instead of
+        materializing the whole response body, which keeps peak
+        memory proportional to the consumed subset on large
+        listings. Requires the optional ijson package.
+        """
+        import ijson
+        response = self.session.get(API_URL + uri, stream=True)
+        if response.status_code != 200:
+            raise APIError(response)
+        # Decompress gzip/deflate transparently; ijson reads the raw
+        # stream directly, bypassing the decoding requests would do.
+        response.raw.decode_content = True
+
+        def generate():
+            try:
+                yield from ijson.items(response.raw, path)
+            finally:
+                response.close()
+        return generate()
+
     def request(self, method, uri, **kwargs):
-        response = requests.request(
-            method,
-            'https://api.fastspring.com' + uri,
-            auth=(self.username, self.password),
-            **kwargs)
+        kwargs.setdefault('stream', True)
+        response = self.session.request(method, API_URL + uri, **kwargs)
         if response.status_code != 200:
             raise APIError(response)
-        data = response.json()
+        body = response.raw.read(decode_content=True)
+        # Keep APIError able to read the body after the raw stream
+        # has been consumed.
+        response._content = body
+        response.close()
+        data = json_loads(body)
         if 'result' in data and data['result'] != 'success':
             raise APIError(response)
         return data
 
 
-class OrderMethodsMixin:
-
-    def synchronize(self):
-        data = current_app.extensions['fastspring'].fetch_order(self.order_id)
-        changed = milliseconds_to_datetime(data['changed'])
-        if self.changed is not None and self.changed >= changed and self.is_complete == data.get('completed'):
-            return False
-        self.reference = data['reference']
-        self.invoice = data['invoiceUrl']
-        self.changed = changed
-        self.is_complete = data['completed']
-        self.data = data
-        return True
-
-    def subscription_item(self):
-        candidates = []
-        for item in self.data['items']:
-            if item.get('subscription'):
-                candidates.append(item)
-        if len(candidates) != 1:
-            return None
-        return candidates[0]
-
-
-class OrderMixin(OrderMethodsMixin):
-
-    order_id = Column(Text, primary_key=True)
-    reference = Column(Text, nullable=False, unique=True)
-    invoice = Column(Text, nullable=False)
-    changed = Column(DateTime(timezone=True), nullable=False)
-    is_complete = Column(Boolean, default=False, nullable=False)
-
-    @declared_attr
-    def data(cls):
-        return deferred(Column(JSON, nullable=False))
-
-
-class SubscriptionMethodsMixin:
-
-    def synchronize(self):
-        data = current_app.extensions['fastspring'].fetch_subscription(self.subscription_id)  # noqa
-        changed = milliseconds_to_datetime(data['changed'])
-        next_event = milliseconds_to_datetime(data.get('next'))
-        if self.changed is not None and self.changed >= changed and self.next_event >= next_event and self.state == data.get('state'):
-            return False
-        self.begin = milliseconds_to_datetime(data['begin'])
-        self.changed = changed
-        self.next_event = milliseconds_to_datetime(data.get('next'))
-        self.next_charge = milliseconds_to_datetime(data.get('nextChargeDate'))
-        self.end = milliseconds_to_datetime(data.get('end'))
-        self.is_active = data['active']
-        self.state = data['state']
-        self.data = data
-        return True
-
-    def cancel(self, immediately=True):
-        return current_app.extensions['fastspring'].cancel_subscription(
-            self.subscription_id, immediately=immediately)
-
-
-class SubscriptionMixin(SubscriptionMethodsMixin):
-
-    subscription_id = Column(Text, primary_key=True)
-    begin = Column(DateTime(timezone=True), nullable=False)
-    changed = Column(DateTime(timezone=True), nullable=False)
-    next_event = Column(DateTime(timezone=True))
-    next_charge = Column(DateTime(timezone=True))
-    end = Column(DateTime(timezone=True))
-    is_active = Column(Boolean, nullable=False)
-    state = Column(Text, nullable=False)
-
-    @declared_attr
-    def data(cls):
-        return deferred(Column(JSON, nullable=False))
+_MS_KEYS = ('begin', 'changed', 'next', 'nextChargeDate', 'end')
+
+# The ORM mixins are provided lazily (PEP 562) so that apps using only
+# the storefront rendering and API client never pay for the SQLAlchemy
+# import at module load.
+
+
+def __getattr__(name):
+    if name in ('OrderMethodsMixin', 'OrderMixin',
+                'SubscriptionMethodsMixin', 'SubscriptionMixin'):
+        _load_orm()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def _load_orm():
+    if 'OrderMixin' in globals():
+        return
+    global OrderMethodsMixin, OrderMixin
+    global SubscriptionMethodsMixin, SubscriptionMixin
+
+    from sqlalchemy import Boolean, Column, DateTime, Text
+    from sqlalchemy.dialects.postgresql import JSONB
+    from sqlalchemy.ext.declarative import declared_attr
+    from sqlalchemy.orm import deferred
+
+    class OrderMethodsMixin:
+
+        def synchronize(self, max_age=None):
+            """Fetch the order and apply changes.
+
+            When max_age (a timedelta) is given and the last fetch is
+            more recent, the round-trip is skipped entirely.
+            """
+            if max_age is not None and self.last_fetched is not None:
+                if datetime.now(UTC) - self.last_fetched < max_age:
+                    return False
+            data = current_app.extensions['fastspring'].fetch_order(self.order_id)
+            return self.synchronize_data(data)
+
+        @staticmethod
+        def synchronize_many(orders):
+            """Synchronize many orders with a single concurrent batch fetch."""
+            fastspring = current_app.extensions['fastspring']
+            results = fastspring.fetch_orders([o.order_id for o in orders])
+            return [o.synchronize_data(results[o.order_id]) for o in orders]
+
+        @classmethod
+        def bulk_synchronize(cls, session, orders):
+            """Synchronize many orders with one bulk UPDATE.
+
+            Unlike synchronize_many, this skips the per-attribute ORM
+            instrumentation and emits batched UPDATE statements, so the
+            loaded objects are left untouched and should be expired or
+            re-loaded by the caller. Returns the number of updated rows.
+            """
+            fastspring = current_app.extensions['fastspring']
+            results = fastspring.fetch_orders([o.order_id for o in orders])
+            now = datetime.now(UTC)
+            mappings = []
+            for order in orders:
+                data = results[order.order_id]
+                changed = milliseconds_to_datetime(data['changed'])
+                if order.changed is not None and order.changed >= changed and order.is_complete == data.get('completed'):
+                    continue
+                mappings.append({
+                    'order_id': order.order_id,
+                    'reference': data['reference'],
+                    'invoice': data['invoiceUrl'],
+                    'changed': changed,
+                    'is_complete': data['completed'],
+                    'last_fetched': now,
+                    'data': data,
+                })
+            session.bulk_update_mappings(cls, mappings)
+            return len(mappings)
+
+        def synchronize_data(self, data):
+            self.last_fetched = datetime.now(UTC)
+            changed = milliseconds_to_datetime(data['changed'])
+            if self.changed is not None and self.changed >= changed and self.is_complete == data.get('completed'):
+                return False
+            self.reference = data['reference']
+            self.invoice = data['invoiceUrl']
+            self.changed = changed
+            self.is_complete = data['completed']
+            self.data = data
+            return True
+
+        def subscription_item(self):
+            items = self.data.get('items', ())
+            found = None
+            for item in items:
+                if item.get('subscription'):
+                    if found is not None:
+                        return None
+                    found = item
+            return found
+
+
+    class OrderMixin(OrderMethodsMixin):
+
+        order_id = Column(Text, primary_key=True)
+        reference = Column(Text, nullable=False, unique=True)
+        invoice = Column(Text, nullable=False)
+        changed = Column(DateTime(timezone=True), nullable=False)
+        is_complete = Column(Boolean, default=False, nullable=False)
+        last_fetched = Column(DateTime(timezone=True))
+
+        @declared_attr
+        def data(cls):
+            return deferred(Column(JSONB, nullable=False))
+
+
+    class SubscriptionMethodsMixin:
+
+        def synchronize(self, max_age=None):
+            """Fetch the subscription and apply changes.
+
+            When max_age (a timedelta) is given and the last fetch is
+            more recent, the round-trip is skipped entirely.
+            """
+            if max_age is not None and self.last_fetched is not None:
+                if datetime.now(UTC) - self.last_fetched < max_age:
+                    return False
+            data = current_app.extensions['fastspring'].fetch_subscription(self.subscription_id)  # noqa
+            return self.synchronize_data(data)
+
+        @staticmethod
+        def synchronize_many(subscriptions):
+            """Synchronize many subscriptions with a single batch fetch."""
+            fastspring = current_app.extensions['fastspring']
+            results = fastspring.fetch_subscriptions(
+                [s.subscription_id for s in subscriptions])
+            return [
+                s.synchronize_data(results[s.subscription_id])
+                for s in subscriptions]
+
+        @classmethod
+        def bulk_synchronize(cls, session, subscriptions):
+            """Synchronize many subscriptions with one bulk UPDATE.
+
+            Unlike synchronize_many, this skips the per-attribute ORM
+            instrumentation and emits batched UPDATE statements, so the
+            loaded objects are left untouched and should be expired or
+            re-loaded by the caller. Returns the number of updated rows.
+            """
+            fastspring = current_app.extensions['fastspring']
+            results = fastspring.fetch_subscriptions(
+                [s.subscription_id for s in subscriptions])
+            now = datetime.now(UTC)
+            mappings = []
+            for subscription in subscriptions:
+                data = results[subscription.subscription_id]
+                begin, changed, next_event, next_charge, end = [
+                    milliseconds_to_datetime(data.get(k)) for k in _MS_KEYS]
+                if subscription.changed is not None and subscription.changed >= changed and subscription.next_event >= next_event and subscription.state == data.get('state'):
+                    continue
+                mappings.append({
+                    'subscription_id': subscription.subscription_id,
+                    'begin': begin,
+                    'changed': changed,
+                    'next_event': next_event,
+                    'next_charge': next_charge,
+                    'end': end,
+                    'is_active': data['active'],
+                    'state': data['state'],
+                    'last_fetched': now,
+                    'data': data,
+                })
+            session.bulk_update_mappings(cls, mappings)
+            return len(mappings)
+
+        def synchronize_data(self, data):
+            self.last_fetched = datetime.now(UTC)
+            begin, changed, next_event, next_charge, end = [
+                milliseconds_to_datetime(data.get(k)) for k in _MS_KEYS]
+            if self.changed is not None and self.changed >= changed and self.next_event >= next_event and self.state == data.get('state'):
+                return False
+            self.begin = begin
+            self.changed = changed
+            self.next_event = next_event
+            self.next_charge = next_charge
+            self.end = end
+            self.is_active = data['active']
+            self.state = data['state']
+            self.data = data
+            return True
+
+        def cancel(self, immediately=True):
+            return current_app.extensions['fastspring'].cancel_subscription(
+                self.subscription_id, immediately=immediately)
+
+
+    class SubscriptionMixin(SubscriptionMethodsMixin):
+
+        subscription_id = Column(Text, primary_key=True)
+        begin = Column(DateTime(timezone=True), nullable=False)
+        changed = Column(DateTime(timezone=True), nullable=False)
+        next_event = Column(DateTime(timezone=True))
+        next_charge = Column(DateTime(timezone=True))
+        end = Column(DateTime(timezone=True))
+        is_active = Column(Boolean, nullable=False)
+        state = Column(Text, nullable=False)
+        last_fetched = Column(DateTime(timezone=True))
+
+        @declared_attr
+        def data(cls):
+            return deferred(Column(JSONB, nullable=False))
 
 
 class APIError(Exception):
 
     def __init__(self, response):
+        r = response.request
+        message = (
+            f'FastSpring API {r.method} at {r.url} failed '
+            f'with status code {response.status_code}:\n{response.text}')
+        super().__init__(message)
         self.response = response
 
-    def __str__(self):
-        template = 'FastSpring API {} at {} failed with status code {}:\n{}'
-        return template.format(
-            self.response.request.method,
-            self.response.request.url,
-            self.response.status_code,
-            self.response.text)
 
+def openssl_aes_encrypt(key, data, local, backend):
+    """Encrypt PKCS7-padded data with AES-128-ECB.
+
+    Allocating a fresh cipher context per payload is the expensive
+    part of small AES jobs, so a context is cached on the given
+    thread-local object and only re-keyed on each call. The context
+    is per-thread because OpenSSL cipher contexts are not thread-safe.
+
+    The backend argument MUST be the OpenSSL cryptography backend.
+    """
+    ctx = getattr(local, 'ctx', None)
+    if ctx is None:
+        ctx = backend._lib.EVP_CIPHER_CTX_new()
+        backend.openssl_assert(ctx != _NULL)
+        ctx = backend._ffi.gc(ctx, backend._lib.EVP_CIPHER_CTX_free)
+        local.ctx = ctx
+    result = _EVP_EncryptInit_ex(ctx, _EVP_aes_128_ecb(), _NULL, key, _NULL)
+    backend.openssl_assert(result == 1)
+    _EVP_CIPHER_CTX_set_padding(ctx, 0)
+    buffer = _ffi_new('unsigned char[]', len(data) + 16)
+    outlen = _ffi_new('int *')
+    result = _EVP_EncryptUpdate(ctx, buffer, outlen, data, len(data))
+    backend.openssl_assert(result == 1)
+    length = outlen[0]
+    result = _EVP_EncryptFinal_ex(ctx, buffer + length, outlen)
+    backend.openssl_assert(result == 1)
+    return backend._ffi.buffer(buffer, length + outlen[0])[:]
+
+
+def rsa_private_encrypt(key, data):
+    """Encrypt data with RSA private key in pure Python.
+
+    Fallback for cryptography builds whose OpenSSL bindings no longer
+    expose the raw signing primitives. Applies PKCS1 v1.5 type 1
+    padding and runs the private-key operation on the key's own
+    numbers; for the 16-byte AES keys secured here the big-integer
+    exponentiation costs around a millisecond.
+    """
+    numbers = key.private_numbers()
+    length = (key.key_size + 7) // 8
+    padding = b'\xff' * (length - len(data) - 3)
+    message = int.from_bytes(b'\x00\x01' + padding + b'\x00' + data, 'big')
+    result = pow(message, numbers.d, numbers.public_numbers.n)
+    return result.to_bytes(length, 'big')
+
+
+def openssl_sign_context(key, backend):
+    """Create a reusable signing context for the RSA private key.
 
-def openssl_private_encrypt(key, data, backend):
+    The deprecated RSA_private_encrypt path allocates a fresh RSA
+    handle on every call. A single EVP_PKEY_CTX configured once with
+    PKCS1 padding can be reused for every payload key instead.
+
+    The backend argument MUST be the OpenSSL cryptography backend.
+    """
+    ctx = backend._lib.EVP_PKEY_CTX_new(key._evp_pkey, backend._ffi.NULL)
+    backend.openssl_assert(ctx != backend._ffi.NULL)
+    ctx = backend._ffi.gc(ctx, backend._lib.EVP_PKEY_CTX_free)
+    result = backend._lib.EVP_PKEY_sign_init(ctx)
+    backend.openssl_assert(result == 1)
+    result = backend._lib.EVP_PKEY_CTX_set_rsa_padding(
+        ctx, backend._lib.RSA_PKCS1_PADDING)
+    backend.openssl_assert(result == 1)
+    return ctx
+
+
+def openssl_private_encrypt(ctx, data, buffer, outlen, backend):
     """Encrypt data with RSA private key.
 
     This is a rewrite of the function from PHP, using cryptography
@@ -252,28 +616,36 @@ def openssl_private_encrypt(key, data, backend):
     non-standard operation and Python packages either don't offer
     it at all, or it's incompatible with the PHP version.
 
+    The ctx argument is a signing context from openssl_sign_context.
+    The buffer and outlen arguments are caller-owned FFI allocations
+    sized for the key, so they can be reused across calls.
     The backend argument MUST be the OpenSSL cryptography backend.
     """
-    length = backend._lib.EVP_PKEY_size(key._evp_pkey)
-    buffer = backend._ffi.new('unsigned char[]', length)
-    result = backend._lib.RSA_private_encrypt(
-        len(data), data, buffer,
-        backend._lib.EVP_PKEY_get1_RSA(key._evp_pkey),
-        backend._lib.RSA_PKCS1_PADDING)
-    backend.openssl_assert(result == length)
-    return backend._ffi.buffer(buffer)[:]
+    outlen[0] = len(buffer)
+    result = _EVP_PKEY_sign(ctx, buffer, outlen, data, len(data))
+    backend.openssl_assert(result == 1)
+    return backend._ffi.buffer(buffer, outlen[0])[:]
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
 
 
 def milliseconds_to_datetime(m):
     if m is None:
         return None
-    return datetime.fromtimestamp(m / 1000, UTC)
+    return _EPOCH + timedelta(milliseconds=m)
+
 
+# The head markup is assembled from fragments so that init_app can
+# compile two specialized templates, with and without the webhook
+# machinery, instead of re-evaluating {% if webhook %} on each render.
 
-HEAD_TEMPLATE = """\
+HEAD_PROLOGUE = """\
 <script type="text/javascript">
 var fscSession = {{ session|tojson }};
-{% if webhook %}
+"""
+
+HEAD_WEBHOOK_SCRIPT = """\
 var fastspringRedirectUrl;
 function fastspringOnPopupWebhookReceived(data) {
   if (!data) return;
@@ -306,17 +678,37 @@ function fastspringOnPopupClosed(data) {
     window.location.replace(fastspringRedirectUrl);
   }
 }
-{% endif %}
+"""
+
+HEAD_SCRIPT_TAG = """\
 </script>
 <script
   id="fsc-api"
   src="https://d1f8f9xcsvx3ha.cloudfront.net/sbl/0.7.4/fastspring-builder.min.js"
   type="text/javascript"
-  {% if webhook %}
+"""
+
+HEAD_WEBHOOK_ATTRIBUTES = """\
   data-popup-webhook-received="fastspringOnPopupWebhookReceived"
   data-popup-closed="fastspringOnPopupClosed"
-  {% endif %}
+"""
+
+HEAD_EPILOGUE = """\
   {% if access_key %}data-access-key="{{ access_key }}"{% endif %}
   data-storefront="{{ storefront }}">
 </script>
 """
+
+# Strip the source indentation once at import; newlines are kept so
+# the JavaScript statements stay separated, but every render emits
+# (and every response carries) fewer bytes.
+def _minify(template):
+    return re.sub(r'\n\s+', '\n', template)
+
+
+HEAD_TEMPLATE = _minify(
+    HEAD_PROLOGUE + HEAD_WEBHOOK_SCRIPT + HEAD_SCRIPT_TAG +
+    HEAD_WEBHOOK_ATTRIBUTES + HEAD_EPILOGUE)
+
+HEAD_TEMPLATE_PLAIN = _minify(
+    HEAD_PROLOGUE + HEAD_SCRIPT_TAG + HEAD_EPILOGUE)
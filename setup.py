@@ -2,7 +2,7 @@ from setuptools import setup
 
 setup(
     name='Flask-FastSpring',
-    version='1.19',
+    version='1.20',
     description='FastSpring API integration for Flask',
     py_modules=['flask_fastspring'],
     install_requires=[
@@ -11,4 +11,7 @@ setup(
         'cryptography>=1.6',
         'requests>=2.12',
         'markupsafe>=2.0'
-    ])
+    ],
+    extras_require={
+        'fast': ['ijson', 'orjson', 'pybase64'],
+    })